@@ -1,4 +1,5 @@
 local tinsert = table.insert
+local pairs = pairs
 
 local http_ng_resty = require ('resty.http_ng.backend.resty')
 local ReportsBatch = require('apicast.policy.3scale_batcher.reports_batch')
@@ -6,19 +7,31 @@ local backend_client = require('apicast.backend_client')
 
 local _M = {}
 
+-- Credentials are a flat table (user_key or app_id/app_key), a shallow copy
+-- is enough for each report row.
+local function copy(tbl)
+  local result = {}
+  for k, v in pairs(tbl or {}) do
+    result[k] = v
+  end
+  return result
+end
+
 -- report: Report the given usage information to the backend
 function _M.report(context, usage)
+  local service_id = context.service.id
+  local credentials = context.credentials
   local backend = backend_client:new(context.service, http_ng_resty)
   local reports = {}
   for key, value in pairs(usage.deltas) do
-    local result = deepcopy(context.credentials)
+    local result = copy(credentials)
     result.metric = key
     result.value = value
-    result.service_id = context.service.id
+    result.service_id = service_id
     tinsert(reports, result)
   end
 
-  local res = backend:report(ReportsBatch.new(context.service.id, reports))
+  local res = backend:report(ReportsBatch.new(service_id, reports))
   if res.status ~= 200 then
     ngx.log(ngx.INFO, "Custom metric report usage failed")
   end
@@ -1,4 +1,5 @@
 local len = string.len
+local str_find = string.find
 local ipairs = ipairs
 local pairs = pairs
 local tinsert = table.insert
@@ -48,6 +49,13 @@ local llm_total_token_count = prometheus(
   {'service_id', 'service_system_name', 'application_id', 'application_system_name'}
 )
 
+-- Usage field reported by the model and the counter it increments
+local usage_metrics = {
+  { field = 'prompt_tokens', counter = llm_prompt_tokens_count },
+  { field = 'completion_tokens', counter = llm_completion_tokens_count },
+  { field = 'total_tokens', counter = llm_total_token_count },
+}
+
 local function get_context(context)
   local ctx = { }
   ctx.req = {
@@ -109,8 +117,10 @@ function _M.new(config)
   self.endpoint = resty_env.get('THREESCALE_PORTAL_ENDPOINT')
   local path = resty_url.split(self.endpoint or '')
   self.path = path and path[6]
+  self.find_application_url = self.endpoint and portal_client.application_find_endpoint(self.endpoint)
   self.rules = {}
   self.enable_sse_support = config.enable_sse_support
+  self.application_cache_ttl = config.application_cache_ttl
   load_rules(self, config.rules or {})
   return self
 end
@@ -123,26 +133,33 @@ function _M.rewrite(context)
     return
   end
 
+  -- Only streaming requests are modified, skip decoding anything else
+  if not str_find(req_body, '"stream"', 1, true) then
+    return
+  end
+
   local success, payload = pcall(cjson.decode, req_body)
-  if not success then
+  if not success or type(payload) ~= 'table' then
     ngx.log(ngx.ERR, "Failed to decode JSON payload")
     return
   end
 
-  -- Check and modify the payload
-  if payload.stream == true then
-    -- Ensure "stream_options" exists
-    if not payload.stream_options then
-      payload.stream_options = {
-        include_usage = true,
-        continuous_usage_stats = true
-      }
-    end
+  if payload.stream ~= true then
+    return
+  end
 
-    -- Modify "include_usage" to true if it's false
-    if payload.stream_options.include_usage == false then
-      payload.stream_options.include_usage = true
-    end
+  -- Ensure "stream_options" exists
+  if not payload.stream_options then
+    payload.stream_options = {
+      include_usage = true,
+      continuous_usage_stats = true
+    }
+  -- Modify "include_usage" to true if it's false
+  elseif payload.stream_options.include_usage == false then
+    payload.stream_options.include_usage = true
+  else
+    -- Usage is already requested, forward the original body as is
+    return
   end
 
   -- Encode the modified payload back to JSON
@@ -157,27 +174,28 @@ end
 function _M:access(context)
   if self.path then
     context.application = { id = "", name = "" }
-  else
-    local service = context.service
-    if not service then
-      ngx.log(ngx.ERR, 'No service in the context')
-      return
-    end
+    return
+  end
 
-    local credentials = context.credentials
-    if not credentials then
-      ngx.log(ngx.WARN, "cannot get credentials: ", err or 'unknown error')
-      return
-    end
+  local service = context.service
+  if not service then
+    ngx.log(ngx.ERR, 'No service in the context')
+    return
+  end
 
-    local application, err = portal_client.find_application(self.endpoint, service.id, credentials)
-    if not application then
-      ngx.log(ngx.WARN, "cannot get application details: ", err or 'unknown error')
-      return
-    end
+  local credentials = context.credentials
+  if not credentials then
+    ngx.log(ngx.WARN, "cannot get credentials from the context")
+    return
+  end
 
-    context.application = application.application
+  local application, err = portal_client.find_application(self.find_application_url, service.id, credentials, self.application_cache_ttl)
+  if not application then
+    ngx.log(ngx.WARN, "cannot get application details: ", err or 'unknown error')
+    return
   end
+
+  context.application = application
 end
 
 local function report_metrics(context)
@@ -187,42 +205,56 @@ local function report_metrics(context)
        return
     end
 
-    local application = context.application
+    -- cjson decodes "usage": null as a truthy cjson.null, check the type
     local usage = context.llm_usage
-
-    if usage and usage.prompt_tokens and usage.prompt_tokens > 0 then
-      llm_prompt_tokens_count:inc(usage.prompt_tokens, {
-        service.id or "",
-        service.system_name or "",
-        application.id or "",
-        application.name or ""
-      })
+    if type(usage) ~= 'table' then
+      return
     end
 
-    if usage and usage.completion_tokens and usage.completion_tokens > 0 then
-      llm_completion_tokens_count:inc(usage.completion_tokens, {
-        service.id or "",
-        service.system_name or "",
-        application.id or "",
-        application.name or ""
-      })
+    local application = context.application or {}
+    local labels = {
+      service.id or "",
+      service.system_name or "",
+      application.id or "",
+      application.name or ""
+    }
+
+    for _, metric in ipairs(usage_metrics) do
+      local tokens = usage[metric.field]
+      if type(tokens) == 'number' and tokens > 0 then
+        metric.counter:inc(tokens, labels)
+      end
     end
+end
 
-    if usage and usage.total_tokens and usage.total_tokens > 0 then
-      llm_total_token_count:inc(usage.total_tokens, {
-        service.id or "",
-        service.system_name or "",
-        application.id or "",
-        application.name or ""
-      })
+-- body_filter runs once per chunk, only inspect the response headers on the
+-- first one and keep the result in the request context. Responses that are
+-- neither SSE nor JSON carry no token usage and are passed through untouched.
+local function response_mode(self)
+  local mode = ngx.ctx.llm_response_mode
+  if mode == nil then
+    local content_type = ngx.header["Content-Type"]
+    if self.enable_sse_support and response.isSSEStreamingResponse(content_type) then
+      mode = "sse"
+    elseif response.isJSONResponse(content_type) then
+      mode = "json"
+    else
+      mode = false
     end
+    ngx.ctx.llm_response_mode = mode
+  end
+  return mode
 end
 
 function _M:body_filter(context)
-  local content_type = ngx.resp.get_headers()["Content-Type"]
   local chunk, finished = ngx.arg[1], ngx.arg[2]
+  local mode = response_mode(self)
 
-  if self.enable_sse_support and response.isSSEStreamingResponse(content_type) then
+  if not mode then
+    return
+  end
+
+  if mode == "sse" then
     if finished then
       return report_metrics(context)
     end
@@ -235,18 +267,20 @@ function _M:body_filter(context)
     end
 
     for _, event in ipairs(events) do
-      if event.data ~= response.CONST.SSE_TERMINATOR then
+      -- Most events are plain token deltas, only decode the ones that can
+      -- carry a usage field.
+      if event.data ~= response.CONST.SSE_TERMINATOR and str_find(event.data, '"usage"', 1, true) then
         local json, err = cjson.decode(event.data)
         if err then
           -- Silencing this for the moment
-          -- ngx.log(ngx.ERR, "unable to read response_body, err: " .. err)
+          -- ngx.log(ngx.ERR, "unable to read response_body, err: ", err)
           ngx.exit(500)
         end
 
         -- Some model include usage field in each event, we only want to
         -- take the last one.
-        local usage = json.usage
-        if usage then
+        local usage = type(json) == 'table' and json.usage
+        if type(usage) == 'table' then
           context.llm_usage = usage
         end
       end
@@ -254,14 +288,16 @@ function _M:body_filter(context)
   else
     local response_body, err = response.get_json_body(chunk, finished)
     if err then
-      ngx.log(ngx.ERR, "unable to read response_body, err: " .. err)
+      ngx.log(ngx.ERR, "unable to read response_body, err: ", err)
       ngx.exit(500)
     end
     if response_body then
-      local usage = response_body.usage
-      local inspect = require 'inspect'
-
-      context.llm_usage = usage
+      -- Valid JSON is not necessarily an object, and "usage": null decodes
+      -- to a truthy cjson.null
+      local usage = type(response_body) == 'table' and response_body.usage
+      if type(usage) == 'table' then
+        context.llm_usage = usage
+      end
       return report_metrics(context)
     end
   end
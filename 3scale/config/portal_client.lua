@@ -1,16 +1,50 @@
 local concat = table.concat
 local insert = table.insert
 local len = string.len
+local str_sub = string.sub
 
 local user_agent = require('apicast.user_agent')
 local resty_url = require ('resty.url')
 local http_ng = require ('resty.http_ng')
 local http_ng_resty = require ('resty.http_ng.backend.resty')
 local resty_env = require ('resty.env')
+local lrucache = require ('resty.lrucache')
 local response = require ('response')
 
 local _M = {}
 
+-- Application details rarely change, so successful lookups are cached per
+-- service and credentials instead of hitting the portal on every request.
+-- Only the application object is kept, not the rest of the find.json payload.
+local APPLICATION_CACHE_SIZE = 1000
+local DEFAULT_APPLICATION_CACHE_TTL = 60
+
+local application_cache = lrucache.new(APPLICATION_CACHE_SIZE)
+
+-- Only log the beginning of an undecodable portal response, error pages can
+-- be large.
+local MAX_LOGGED_BODY = 1024
+
+local http_client
+
+-- Portal lookups always go to the same host, so build the client once
+-- per worker instead of on every request.
+local function client()
+  if not http_client then
+    http_client = http_ng.new{
+      backend = http_ng_resty,
+      options = {
+        headers = {
+          ['User-Agent'] = user_agent()
+        },
+        ssl = { verify = resty_env.enabled('OPENSSL_VERIFY') }
+      }
+    }
+  end
+
+  return http_client
+end
+
 local function build_args(args)
   local query = {}
 
@@ -24,17 +58,35 @@ local function build_args(args)
   return concat(query, '&')
 end
 
-local function application_find_endpoint(portal_endpoint)
+-- Build the /admin/api/applications/find.json URL for a portal endpoint. The
+-- policy does this once when it is created and passes the result to
+-- find_application.
+function _M.application_find_endpoint(portal_endpoint)
   return resty_url.join(portal_endpoint, '/admin/api/applications/find.json')
 end
 
--- Call /admin/api/applications/find.json
-function _M.find_application(endpoint, service_id, credentials)
-  if not endpoint then
+-- Call the find.json URL built by application_find_endpoint and return the
+-- application object.
+-- cache_ttl is in seconds, 0 disables the application cache.
+function _M.find_application(base_url, service_id, credentials, cache_ttl)
+  if not base_url then
     return nil, "No endpoint available"
   end
 
-  local base_url = application_find_endpoint(endpoint)
+  cache_ttl = cache_ttl or DEFAULT_APPLICATION_CACHE_TTL
+  local use_cache = cache_ttl > 0
+
+  -- The key leaves out the endpoint, which embeds the portal access token
+  local cache_key
+  if use_cache then
+    cache_key = service_id .. ':' .. build_args({credentials})
+
+    local cached = application_cache:get(cache_key)
+    if cached then
+      return cached
+    end
+  end
+
   local authentication = { service_id = service_id }
   local args = {authentication, credentials}
 
@@ -42,29 +94,27 @@ function _M.find_application(endpoint, service_id, credentials)
 
   ngx.log(ngx.DEBUG, 'fetching application details at ', url)
 
-  local http_client = http_ng.new{
-    backend = http_ng_resty,
-    options = {
-      headers = {
-        ['User-Agent'] = user_agent()
-      },
-      ssl = { verify = resty_env.enabled('OPENSSL_VERIFY') }
-    }
-  }
-
-  local res = http_client.get(url)
+  local res = client().get(url)
 
   if res.status == 200 then
     local val, err = response.decode_json(res)
       if err then
-      ngx.log(ngx.ERR, 'invalid application response, cannot decode the message: ', res.headers.content_type, ', error:', err ,', body: ', res.body)
+      ngx.log(ngx.ERR, 'invalid application response, cannot decode the message: ', res.headers.content_type, ', error:', err ,', body: ', str_sub(res.body or '', 1, MAX_LOGGED_BODY))
       return nil, "Cannot decode application request response"
     end
-    return val
+
+    local application = type(val) == 'table' and val.application
+    if type(application) ~= 'table' then
+      return nil, "No application in the response"
+    end
+
+    if use_cache then
+      application_cache:set(cache_key, application, cache_ttl)
+    end
+    return application
   else
-    return nil, 'invalid response - status: ' .. res.status
+    return nil, 'invalid response - status: ' .. tostring(res.status) .. (res.error and (', error: ' .. tostring(res.error)) or '')
   end
 end
 
-
 return _M
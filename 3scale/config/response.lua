@@ -4,6 +4,7 @@ local Mime = require 'resty.mime'
 local str_find = string.find
 local str_sub = string.sub
 local concat = table.concat
+local new_tab = require 'table.new'
 local split = require 'pl.stringx'.split
 
 local arg = ngx.arg
@@ -34,7 +35,7 @@ function _M.get_raw_body(chunk, finished)
 
   if type(chunk) == "string" and chunk ~= "" then
     if not buffered then
-      buffered = {} -- XXX we can use table.new here
+      buffered = new_tab(8, 0)
       ngx.ctx.buffered_response_body = buffered
     end
 
@@ -68,6 +69,10 @@ function _M.isSSEStreamingResponse(content_type)
   return sse_content_types[mime_type(content_type)]
 end
 
+function _M.isJSONResponse(content_type)
+  return json_content_types[mime_type(content_type)]
+end
+
 
 function _M.decode_json(response)
     if json_content_types[mime_type(response.headers.content_type)] then
@@ -143,7 +148,7 @@ local function parse_sse_events(chunk)
     -- check if this is a truncated line
     if #line > 0 and #event_lines == i then
       if not buffered then
-        buffered = {} -- XXX we can use table.new here
+        buffered = new_tab(2, 0)
         ngx.ctx.sse_truncated_event = buffered
       end
 